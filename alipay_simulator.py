@@ -2,25 +2,39 @@
 # --------------------------------------------------------------------
 # This is a self-contained Flask+sqlite3 demo for a minimal "Alipay-like"
 # payment system. Features:
-#  - User registration, login, logout
+#  - User registration, login, logout (salted scrypt password hashes;
+#    legacy plaintext passwords are re-hashed on the next successful login)
 #  - Balance inquiry, peer-to-peer transfer
 #  - Full transaction history (each entry with balance snapshot)
 #  - API export of all records with token-protected authentication
-#  - Pure Python, HTML templates embedded, one-file for direct execution
+#  - Pure Python, HTML templates embedded in this one file
+#  - Default server is the prefork multi-process server from prefork.py, which
+#    must sit next to this file; --dev runs this file alone on the Flask dev server
 #  - English code style and comments, all variable names in English
 #  - Safe SQL practices; no list comprehensions or expression nesting
 #  - User's initial balance is 0
 # Dependencies: flask
 #
-# Usage: python alipay_simulator.py
+# Usage: python alipay_simulator.py [--workers N] [--port PORT] [--dev]
 # --------------------------------------------------------------------
 import os
+import hmac
+import hashlib
 import sqlite3
 import secrets
+import argparse
 from flask import Flask, session, request, redirect, url_for, render_template_string, flash, g, jsonify
+from flask import get_flashed_messages, stream_with_context
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_please_change'
 DATABASE = 'alipay_sim.db'
+app.config.update(
+    RECORD_STREAMING=True,                     # Stream /record while rows are read
+    STREAM_BUFFER_SIZE=8192,                   # Characters buffered per sent chunk
+    PASSWORD_HASH_COST=14,                     # scrypt N = 2**cost (about 16MB per hash)
+    PASSWORD_HASH_R=8,
+    PASSWORD_HASH_P=1,
+)
 # ======================= Database & Utility Functions ====================== #
 def get_db():
     """Get a database connection returning Row objects (dict-style access)."""
@@ -31,8 +45,8 @@ def get_db():
     return db
 @app.teardown_appcontext
 def close_connection(exception):
-    """Close database connection after each request."""
-    db = getattr(g, '_database', None)
+    """Close database connection after each request (and drop it from g so a streamed response can reopen one)."""
+    db = g.pop('_database', None)
     if db is not None:
         db.close()
 def initialize_db():
@@ -44,7 +58,7 @@ def initialize_db():
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,         -- User ID
                 username TEXT UNIQUE NOT NULL,                -- Username (unique)
-                password TEXT NOT NULL,                       -- Plain password (for demo only)
+                password TEXT NOT NULL,                       -- scrypt hash (see hash_password)
                 balance REAL DEFAULT 0,                       -- Current balance，default 0
                 api_token TEXT                                -- User's API token
             )
@@ -62,6 +76,49 @@ def initialize_db():
             )
         ''')                                                # Commit transaction
         db.commit()
+# ============================ Password Hashing ============================ #
+# Same storage format as passwords.py: scrypt$<log2 N>$<r>$<p>$<salt hex>$<key hex>
+# Hashing runs on the request thread: prefork workers are single-threaded.
+def scrypt_key(password, salt, cost, r, p):
+    """Derive a 32-byte scrypt key (maxmem raised above OpenSSL's 32MB default)."""
+    n = 1 << cost
+    maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=32)
+def hash_password(password):
+    """Hash a password with a random salt and the configured cost."""
+    cost = app.config['PASSWORD_HASH_COST']
+    r = app.config['PASSWORD_HASH_R']
+    p = app.config['PASSWORD_HASH_P']
+    salt = os.urandom(16)
+    key = scrypt_key(password, salt, cost, r, p)
+    return 'scrypt$%d$%d$%d$%s$%s' % (cost, r, p, salt.hex(), key.hex())
+def is_hashed(stored):
+    """False for legacy plaintext passwords."""
+    return stored.startswith('scrypt$')
+def verify_password(password, stored):
+    """Constant-time check against a stored hash (plaintext legacy values compared directly)."""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, cost, r, p, salt, key = stored.split('$')
+        actual = scrypt_key(password, bytes.fromhex(salt), int(cost), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, bytes.fromhex(key))
+def needs_rehash(stored):
+    """Plaintext, or hashed with parameters other than the configured ones."""
+    if not is_hashed(stored):
+        return True
+    wanted = '%d$%d$%d' % (app.config['PASSWORD_HASH_COST'], app.config['PASSWORD_HASH_R'],
+                           app.config['PASSWORD_HASH_P'])
+    return stored.split('$', 4)[1:4] != wanted.split('$')
+dummy_hash = []                                # Lazily built, cached per process
+def verify_dummy(password):
+    """Spend one hash verification on a fixed dummy, so unknown users take as long as real ones."""
+    if not dummy_hash:
+        dummy_hash.append(hash_password(secrets.token_hex(16)))
+    verify_password(password, dummy_hash[0])
+    return False
 def get_user_by_id(user_id):
     """Fetch user using user_id."""
     db = get_db()
@@ -80,34 +137,60 @@ def set_user_token(user_id):
     db.execute("UPDATE users SET api_token=? WHERE id=?", (token, user_id))       # Update user token
     db.commit()
     return token
-def get_transactions_with_balance(user_id):
+class TransactionRow:
+    """One transaction with post-transaction balance; slots keep it small, row['field'] works in templates."""
+    __slots__ = ('id', 'time', 'amount', 'from_user', 'to_user',
+                 'from_username', 'to_username', 'post_balance')
+    def __init__(self, id, time, amount, from_user, to_user, from_username, to_username, post_balance):
+        self.id = id
+        self.time = time
+        self.amount = amount
+        self.from_user = from_user
+        self.to_user = to_user
+        self.from_username = from_username
+        self.to_username = to_username
+        self.post_balance = post_balance
+    def __getitem__(self, key):
+        return getattr(self, key)
+    def to_dict(self):
+        """Plain dict copy (for JSON export)."""
+        result = {}
+        for name in self.__slots__:
+            result[name] = getattr(self, name)
+        return result
+def iter_transactions_with_balance(user_id):
     """
-    Return all transactions of a user including balance after each.
-    Each item: dict with post_balance field.
+    All of a user's transactions in time order, one TransactionRow (with post_balance) at a time.
+    The view's connection is closed by the teardown that runs when the view returns; get_db() here
+    reopens one inside the context kept by stream_with_context, closed by the teardown after the stream.
     """
-    db = get_db()
-    # Query all user's transactions (ascending by time)
     sql = '''
         SELECT t.id, t.time, t.amount, t.from_user, t.to_user,
-               u1.username AS from_username,
-               u2.username AS to_username
+               u1.username, u2.username
         FROM transactions t
         LEFT JOIN users u1 ON t.from_user = u1.id
         LEFT JOIN users u2 ON t.to_user = u2.id
         WHERE t.from_user=? OR t.to_user=?
         ORDER BY t.time ASC, t.id ASC
     '''
-    cur = db.execute(sql, (user_id, user_id))
-    records = []
+    cur = get_db().cursor()
+    cur.row_factory = None                     # Plain tuples, no Row objects
     balance = 0.0                              # Initial balance is 0
-    for row in cur:
-        row_dict = dict(row)
-        if row["from_user"] == user_id:
-            balance -= row["amount"]           # If sent, reduce balance
-        elif row["to_user"] == user_id:
-            balance += row["amount"]           # If received, increase balance
-        row_dict["post_balance"] = round(balance, 2)
-        records.append(row_dict)
+    for tid, time, amount, from_user, to_user, from_username, to_username in cur.execute(sql, (user_id, user_id)):
+        if from_user == user_id:
+            balance -= amount                  # If sent, reduce balance
+        elif to_user == user_id:
+            balance += amount                  # If received, increase balance
+        yield TransactionRow(tid, time, amount, from_user, to_user,
+                             from_username, to_username, round(balance, 2))
+def get_transactions_with_balance(user_id):
+    """
+    Return all transactions of a user including balance after each.
+    Each item: dict with post_balance field. Built on iter_transactions_with_balance so both stay in step.
+    """
+    records = []
+    for row in iter_transactions_with_balance(user_id):
+        records.append(row.to_dict())
     return records
 def get_last_balance(records):
     """Get the final balance from user's records, or 0."""
@@ -123,6 +206,25 @@ def require_login(f):
             return redirect(url_for("login"))
         return f(*args, **kw)
     return wrapper
+def stream_template_string(source, **context):
+    """Render a template source as a streamed response, sent in STREAM_BUFFER_SIZE chunks."""
+    get_flashed_messages()                     # Pop flashes before headers go out, so the session is saved
+    app.update_template_context(context)
+    template = app.jinja_env.from_string(source)
+    buffer_size = app.config['STREAM_BUFFER_SIZE']
+    def generate():
+        chunks = []
+        size = 0
+        for chunk in template.generate(context):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                yield ''.join(chunks)
+                chunks = []
+                size = 0
+        if chunks:
+            yield ''.join(chunks)
+    return app.response_class(stream_with_context(generate()), mimetype='text/html')
 # ============================ Views / Routes ============================ #
 @app.route("/")
 @require_login
@@ -144,7 +246,8 @@ def register():
         if db.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone():
             flash('Username already exists')
             return render_template_string(TEMPLATES['register'])
-        db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))    # Add new user
+        db.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                   (username, hash_password(password)))                # Add new user, store hash only
         db.commit()
         flash('Registration successful, please log in')
         return redirect(url_for('login'))
@@ -156,8 +259,18 @@ def login():
         username = request.form['username'].strip()
         password = request.form['password']
         db = get_db()
-        user = db.execute("SELECT id FROM users WHERE username=? AND password=?", (username, password)).fetchone()
-        if user:
+        user = db.execute("SELECT id, password FROM users WHERE username=?", (username,)).fetchone()
+        if user is None:
+            ok = verify_dummy(password)               # Same cost as a real check: hides unknown usernames
+        elif not is_hashed(user["password"]):
+            verify_dummy(password)                    # Plaintext rows cost the same as hashed ones
+            ok = verify_password(password, user["password"])
+        else:
+            ok = verify_password(password, user["password"])
+        if ok:
+            if needs_rehash(user["password"]):        # Migrate plaintext / old-cost hashes
+                db.execute("UPDATE users SET password=? WHERE id=?", (hash_password(password), user["id"]))
+                db.commit()
             session["user_id"] = user["id"]
             token = set_user_token(user["id"])        # Issue new API token at login
             session["api_token"] = token
@@ -218,6 +331,9 @@ def record():
     """Show user's transaction records with balance per transaction."""
     user_id = session["user_id"]
     user = get_user_by_id(user_id)
+    if app.config['RECORD_STREAMING']:
+        records = iter_transactions_with_balance(user_id)          # Template tracks the last balance itself
+        return stream_template_string(TEMPLATES['record'], user=user, records=records, last_balance=0.0, api_token=session['api_token'])
     records = get_transactions_with_balance(user_id)
     last_balance = get_last_balance(records)
     return render_template_string(TEMPLATES['record'], user=user, records=records, last_balance=last_balance, api_token=session['api_token'])
@@ -407,6 +523,8 @@ TEMPLATES = {
 {% block title %}Transaction Records{% endblock %}
 {% block content %}
   <h2 class="gold-title text-center mt-4 mb-4">Transaction History</h2>
+  {# records may be a lazy iterator; remember the last balance while looping #}
+  {% set balance = namespace(last=last_balance) %}
   <table class="table table-gold table-bordered table-hover" style="background:rgba(255,250,220,0.97)">
     <thead>
       <tr>
@@ -419,6 +537,7 @@ TEMPLATES = {
     </thead>
     <tbody>
       {% for tx in records %}
+      {% set balance.last = tx['post_balance'] %}
       <tr>
         <td>{{ tx['time'] }}</td>
         <td>
@@ -449,7 +568,7 @@ TEMPLATES = {
   </table>
   <div class="text-center mt-3">
     <span style="color:#997b33;font-size:1.1em;">
-      Current Balance: <b>{{ last_balance }}</b>
+      Current Balance: <b>{{ balance.last }}</b>
     </span>
     <br>
     <button class="btn btn-gold mt-3" id="exportBtn">Export All Records (JSON)</button>
@@ -487,11 +606,56 @@ TEMPLATES = {
 for k in TEMPLATES:
     TEMPLATES[k] = TEMPLATES[k].replace('{% extends base_template %}', '{% extends "__base__" %}')
 TEMPLATES['__base__'] = BASE_TEMPLATE
-# ============================ Main Entry ============================ #
-if __name__ == "__main__":
+# ===================== App Factory & Worker Hooks ===================== #
+worker_init_hooks = []                         # Run in each worker after fork
+worker_index = 0                               # This worker's number (0..N-1), 0 when single-process
+def on_worker_init(f):
+    """Decorator: register a per-worker init hook, called with the app."""
+    worker_init_hooks.append(f)
+    return f
+def run_worker_init_hooks(index=0):
+    """Record this worker's number and run all per-worker init hooks in the current process."""
+    global worker_index
+    worker_index = index
+    for hook in worker_init_hooks:
+        hook(app)
+def create_app(config=None):
+    """App factory: apply config, ensure DB exists, attach embedded templates."""
+    if config:
+        app.config.update(config)
     if not os.path.exists(DATABASE):          # Ensure first-run setup
         initialize_db()
     # Attach in-memory template loader (maps template name => source)
     app.jinja_loader = type('TplLoader', (), {'get_source': lambda self, env, name:
-                                              (TEMPLATES[name], name, lambda: True)})
-    app.run(debug=False)
+                                              (TEMPLATES[name], name, lambda: True)})()
+    return app
+# ============================ Main Entry ============================ #
+def positive_int(value):
+    """argparse type: an integer of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('must be an integer >= 1: %r' % value)
+    return number
+def main(argv=None):
+    """CLI: run the prefork multi-process server, or the dev server with --dev."""
+    parser = argparse.ArgumentParser(description='Alipay Simulator server')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address')
+    parser.add_argument('--port', type=int, default=5000, help='Bind port')
+    parser.add_argument('--workers', type=positive_int, default=None, help='Worker processes (default: CPU cores)')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='Seconds to wait for in-flight requests on shutdown')
+    parser.add_argument('--request-timeout', type=float, default=10.0,
+                        help='Per-connection read/write timeout in seconds')
+    parser.add_argument('--dev', action='store_true', help='Use the single-process Flask dev server')
+    args = parser.parse_args(argv)
+    create_app()
+    if args.dev:
+        run_worker_init_hooks()
+        app.run(host=args.host, port=args.port, debug=False)
+        return
+    from prefork import serve                 # Needs prefork.py next to this file
+    serve(app, args.host, args.port, workers=args.workers,
+          post_fork=run_worker_init_hooks, graceful_timeout=args.graceful_timeout,
+          request_timeout=args.request_timeout)
+if __name__ == "__main__":
+    main()
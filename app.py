@@ -1,13 +1,91 @@
 import sqlite3
 import os
+import argparse
 from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify
+from flask import get_flashed_messages, stream_with_context
 import datetime
 import secrets
+import math
+from functools import wraps
+from contextlib import contextmanager
+from ratelimit import TokenBucketLimiter, WriteGate
+from passwords import PasswordHasher, HasherBusy
+from user_index import UsernameIndex
+import columnar
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_please_change'
 DATABASE = 'alipay.db'
 
+# 限流配置: 各预算为 (每秒补充令牌数, 桶容量), 按API token或登录用户分别计数
+app.config.update(
+    RATELIMIT_ENABLED=True,
+    RATELIMIT_BUDGETS={
+        'export': (0.2, 3),    # 全量导出, 代价高
+        'read': (5.0, 20),     # 普通页面查询
+        'search': (10.0, 30),  # 用户名自动补全, 输入时频繁触发, 单独计数以免挤占页面查询预算
+        'write': (1.0, 5),     # 转账等写操作
+    },
+    RATELIMIT_MAX_KEYS=100000,
+    WRITE_CONCURRENCY_LIMIT=4,  # 全局(跨工作进程)在途写操作上限
+    WRITE_RETRY_AFTER=1,
+    WORKERS=1,                  # 工作进程数, 写并发闸门按此分配槽位; 由main()按实际进程数设置
+)
+
+# 密码哈希配置: scrypt代价为 N=2**PASSWORD_HASH_COST
+# prefork工作进程是单线程的, 每个进程同一时刻只处理一个请求, 哈希直接在请求线程计算即可;
+# 进程池只在多线程服务器 (如gunicorn gthread) 上有意义, 此时再把 PASSWORD_HASH_WORKERS 设为正数
+app.config.update(
+    PASSWORD_HASH_COST=14,
+    PASSWORD_HASH_R=8,
+    PASSWORD_HASH_P=1,
+    PASSWORD_HASH_WORKERS=0,        # 每个工作进程的哈希进程数, 0表示在请求线程内直接计算
+    PASSWORD_HASH_MAX_PENDING=32,   # 使用进程池时, 每个工作进程同时排队的哈希任务上限
+    PASSWORD_HASH_TIMEOUT=10,
+)
+
+# 用户名前缀索引配置
+app.config.update(
+    USER_INDEX_SYNC_INTERVAL=2.0,   # 工作进程间增量同步新注册用户的间隔(秒)
+    USER_SEARCH_MAX_LIMIT=20,       # 自动补全单次最多返回条数
+)
+
+# 转账记录页流式渲染: 边查询边输出, 首字节不必等全部记录查完, 内存占用与记录条数无关
+app.config.update(
+    RECORD_STREAMING=True,
+    STREAM_BUFFER_SIZE=8192,        # 攒够这么多字符再发送一次, 避免过多小块写入
+)
+
+# --------------------- 工作进程钩子 ------------------------ #
+
+# fork后在每个工作进程内执行的初始化/退出钩子 (连接池、缓存等不能跨进程共享的资源)
+worker_init_hooks = []
+worker_exit_hooks = []
+# 当前工作进程编号 (prefork为0..WORKERS-1); 外部服务器不提供稳定编号时为None
+worker_index = None
+
+def on_worker_init(f):
+    """装饰器: 注册工作进程初始化钩子, 钩子函数接收app作为参数"""
+    worker_init_hooks.append(f)
+    return f
+
+def on_worker_exit(f):
+    """装饰器: 注册工作进程退出钩子, 在途请求处理完毕后调用, 钩子函数接收app作为参数"""
+    worker_exit_hooks.append(f)
+    return f
+
+def run_worker_init_hooks(index=None):
+    """记下当前工作进程编号(可选), 并在当前进程内依次执行所有工作进程初始化钩子"""
+    global worker_index
+    worker_index = index
+    for hook in worker_init_hooks:
+        hook(app)
+
+def run_worker_exit_hooks():
+    """在当前进程内依次执行所有工作进程退出钩子"""
+    for hook in worker_exit_hooks:
+        hook(app)
+
 # --------------------- 数据库工具和初始化 ------------------------ #
 
 def get_db():
@@ -20,8 +98,8 @@ def get_db():
 
 @app.teardown_appcontext
 def close_connection(exception):
-    """请求完成后关闭数据库连接"""
-    db = getattr(g, '_database', None)
+    """请求完成后关闭数据库连接 (同时清除g上的引用, 流式响应中再次调用get_db()会重新打开)"""
+    db = g.pop('_database', None)
     if db is not None:
         db.close()
 
@@ -48,6 +126,18 @@ def init_db():
             FOREIGN KEY(to_user) REFERENCES users(id)
         )''')
         db.commit()
+    ensure_indexes()
+
+def ensure_indexes():
+    """
+    创建查询所需的索引 (已存在则跳过), 旧数据库启动时同样会补建。
+    api_token 索引: 限流在取令牌前先按token查用户, 无索引时每个 /api/records 请求
+    (包括被限流拒绝的) 都要全表扫描users
+    """
+    with app.app_context():
+        db = get_db()
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_api_token ON users(api_token)")
+        db.commit()
 
 # --------------------- 工具函数 ------------------------ #
 
@@ -77,18 +167,46 @@ def update_user_token(user_id):
     db.commit()
     return token
 
-def get_transfers_with_balance(user_id):
+class TransferRow:
+    """一条转账记录(含该笔之后余额), 用__slots__减少内存; 支持 r['字段'] 方式访问, 模板无需改动"""
+    __slots__ = ('id', 'time', 'amount', 'from_user', 'to_user',
+                 'from_username', 'to_username', 'post_balance')
+
+    def __init__(self, id, time, amount, from_user, to_user, from_username, to_username, post_balance):
+        self.id = id
+        self.time = time
+        self.amount = amount
+        self.from_user = from_user
+        self.to_user = to_user
+        self.from_username = from_username
+        self.to_username = to_username
+        self.post_balance = post_balance
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self):
+        """转为普通字典 (JSON导出用)"""
+        result = {}
+        for name in self.__slots__:
+            result[name] = getattr(self, name)
+        return result
+
+def query_transfers(user_id, epoch_time=False):
     """
-    查询某用户的所有转账记录（收与支），并为每笔记录补充发生后的余额。
-    - 保证SQL无表达式嵌套 (逐条拼余额)
-    - 返回列表：[{"记录基础字段", "post_balance": 余额}]
+    按时间顺序查询某用户的所有转账记录（收与支）, 返回元组游标 (不构造Row对象):
+    (id, time, amount, from_user, to_user, from_username, to_username)
+    epoch_time为True时时间转为UTC秒级时间戳 (列式导出用), 否则为数据库中的时间字符串
     """
-    db = get_db()
-    # 查询时间顺序下所有相关记录
-    cur = db.execute(
-        '''SELECT t.id, t.time, t.amount, t.from_user, t.to_user,
-                  u1.username AS from_username,
-                  u2.username AS to_username
+    if epoch_time:
+        time_column = "CAST(strftime('%s', t.time) AS INTEGER)"
+    else:
+        time_column = "t.time"
+    cur = get_db().cursor()
+    cur.row_factory = None
+    cur.execute(
+        '''SELECT t.id, ''' + time_column + ''', t.amount, t.from_user, t.to_user,
+                  u1.username, u2.username
            FROM transfers t
            LEFT JOIN users u1 ON t.from_user = u1.id
            LEFT JOIN users u2 ON t.to_user = u2.id
@@ -96,22 +214,40 @@ def get_transfers_with_balance(user_id):
            ORDER BY t.time ASC, t.id ASC''',
         (user_id, user_id)
     )
-    records = []
-    # 起始余额
+    return cur
+
+def iter_transfer_tuples(user_id, epoch_time=False):
+    """
+    逐条读取 query_transfers 的结果并累计余额 (初始余额0), 每次产出一个元组:
+    (id, time, amount, from_user, to_user, from_username, to_username, post_balance)
+    所有按记录计算余额的地方 (页面、JSON导出、列式导出) 都经过这里
+    """
     balance = 0
-    # 查询注册后的初始余额
-    user = get_user_by_id(user_id)
-    if user is not None:
-        balance = 0  # 注册默认0
-    # 依次计算每一行的余额变化
-    for row in cur:
-        row_dict = dict(row)
-        if row["from_user"] == user_id:
-            balance -= row["amount"]
-        elif row["to_user"] == user_id:
-            balance += row["amount"]
-        row_dict["post_balance"] = round(balance, 2)
-        records.append(row_dict)
+    for tid, time, amount, from_user, to_user, from_username, to_username in query_transfers(user_id, epoch_time):
+        if from_user == user_id:
+            balance -= amount
+        elif to_user == user_id:
+            balance += amount
+        yield (tid, time, amount, from_user, to_user, from_username, to_username, round(balance, 2))
+
+def iter_transfers_with_balance(user_id):
+    """
+    惰性版本: 每次产出一个TransferRow, 不在内存中保留历史记录。
+    流式响应在视图返回时已执行过一次teardown, 视图使用的连接已关闭并从g上清除;
+    此处的get_db()在stream_with_context保持的上下文中重新打开连接, 由流结束时的teardown关闭,
+    同一时刻每个请求只持有一个连接
+    """
+    for row in iter_transfer_tuples(user_id):
+        yield TransferRow(*row)
+
+def get_transfers_with_balance(user_id):
+    """
+    查询某用户的所有转账记录（收与支），并为每笔记录补充发生后的余额。
+    - 返回列表：[{"记录基础字段", "post_balance": 余额}]
+    """
+    records = []
+    for row in iter_transfers_with_balance(user_id):
+        records.append(row.to_dict())
     return records
 
 def get_last_balance_from_records(records):
@@ -121,11 +257,25 @@ def get_last_balance_from_records(records):
     else:
         return records[-1]["post_balance"]
 
+# --------------------- 用户名索引 ------------------------ #
+
+# 启动时在create_app中加载(fork之前), 注册时增量更新
+username_index = UsernameIndex()
+
+@on_worker_init
+def start_username_sync(app):
+    """工作进程内启动后台线程, 同步其他工作进程注册的新用户"""
+    username_index.start_sync(DATABASE, app.config['USER_INDEX_SYNC_INTERVAL'])
+
+@on_worker_exit
+def stop_username_sync(app):
+    """停止用户名索引同步线程"""
+    username_index.stop_sync()
+
 # --------------------- 认证相关 ------------------------ #
 
 def login_required(f):
     """登录保护的装饰器"""
-    from functools import wraps
     @wraps(f)
     def wrapper(*args, **kwargs):
         if "user_id" not in session:
@@ -133,10 +283,176 @@ def login_required(f):
         return f(*args, **kwargs)
     return wrapper
 
+# 由 init_password_hasher() 按配置创建; 进程池在工作进程内首次使用时创建
+password_hasher = None
+
+def init_password_hasher():
+    """按app.config创建密码哈希器"""
+    global password_hasher
+    if password_hasher is not None:
+        password_hasher.shutdown()
+    password_hasher = PasswordHasher(
+        cost=app.config['PASSWORD_HASH_COST'],
+        r=app.config['PASSWORD_HASH_R'],
+        p=app.config['PASSWORD_HASH_P'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+    )
+
+init_password_hasher()
+
+@on_worker_init
+def start_password_pool(app):
+    """工作进程启动时生成假哈希, 配置了进程池时预先拉起哈希进程, 避免首个登录请求等待"""
+    password_hasher.start()
+
+@on_worker_exit
+def stop_password_pool(app):
+    """工作进程退出时关闭哈希进程池"""
+    password_hasher.shutdown()
+
+# --------------------- 限流与准入控制 ------------------------ #
+
+# 由 init_admission_control() 按配置创建; 未创建时不做限制
+limiters = {}
+write_gate = None
+
+def init_admission_control():
+    """按app.config创建限流器和写并发闸门, 需在fork工作进程之前调用"""
+    global write_gate
+    limiters.clear()
+    write_gate = None
+    if not app.config['RATELIMIT_ENABLED']:
+        return
+    for budget, (rate, burst) in app.config['RATELIMIT_BUDGETS'].items():
+        limiters[budget] = TokenBucketLimiter(rate, burst, app.config['RATELIMIT_MAX_KEYS'])
+    write_gate = WriteGate(app.config['WRITE_CONCURRENCY_LIMIT'], app.config['WORKERS'],
+                           app.config['WRITE_RETRY_AFTER'])
+
+@on_worker_init
+def bind_write_gate(app):
+    """工作进程占用自己在写并发闸门中的槽位 (有编号时优先使用同号槽位)"""
+    if write_gate is not None:
+        write_gate.bind_worker(worker_index)
+
+def release_worker_writes(index):
+    """主进程回收工作进程后调用: 清零其占用的写入名额 (被强制结束时来不及自行释放)"""
+    if write_gate is not None:
+        write_gate.release_worker(index)
+
+def get_token_user(token):
+    """按api_token查找用户, 同一请求内缓存结果 (限流与视图共用一次查询)"""
+    cache = g.setdefault('_token_users', {})
+    if token not in cache:
+        cache[token] = get_user_by_token(token)
+    return cache[token]
+
+def rate_limit_key():
+    """
+    限流key: 优先登录用户, 其次有效的API token, 最后客户端地址。
+    无效token计入客户端地址, 避免轮换伪造token绕过限流或挤占真实用户的桶
+    """
+    if "user_id" in session:
+        return "user:%s" % session["user_id"]
+    token = request.args.get('token')
+    if token and get_token_user(token) is not None:
+        return "token:" + token
+    return "ip:%s" % request.remote_addr
+
+def too_many_requests(retry_after):
+    """返回429响应并带上Retry-After头"""
+    if request.path.startswith('/api/'):
+        resp = jsonify({"error": "请求过于频繁, 请稍后重试"})
+    else:
+        resp = app.response_class("请求过于频繁, 请稍后重试", mimetype='text/plain')
+    resp.status_code = 429
+    resp.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+def rate_limited(budget, methods=None):
+    """装饰器: 按预算budget对视图限流, methods为空表示所有请求方法都计数"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            limiter = limiters.get(budget)
+            if limiter is not None and (methods is None or request.method in methods):
+                wait = limiter.acquire(rate_limit_key())
+                if wait > 0:
+                    return too_many_requests(wait)
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class WriteRejected(Exception):
+    """全局写入名额已满"""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+@app.errorhandler(WriteRejected)
+def handle_write_rejected(exc):
+    """写入名额已满: 返回429而不是排队等待SQLite写锁"""
+    return too_many_requests(exc.retry_after)
+
+@contextmanager
+def write_slot():
+    """占用一个全局写入名额执行数据库写操作, 名额已满时抛出WriteRejected"""
+    gate = write_gate
+    if gate is None:
+        yield
+        return
+    if not gate.try_enter():
+        raise WriteRejected(gate.retry_after)
+    try:
+        yield
+    finally:
+        gate.leave()
+
+def write_admission(f):
+    """装饰器: POST请求整体占用一个全局写入名额"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if request.method != 'POST':
+            return f(*args, **kwargs)
+        with write_slot():
+            return f(*args, **kwargs)
+    return wrapper
+
+# --------------------- 流式渲染 ------------------------ #
+
+def stream_template(template_name, **context):
+    """
+    以流式响应渲染模板: 模板中的迭代器在输出过程中才被消费,
+    输出按 STREAM_BUFFER_SIZE 攒成块后发送
+    """
+    # 响应头发出后无法再回写session, 先取出闪现消息(结果缓存在本次请求上, 模板中照常读取)
+    get_flashed_messages()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    buffer_size = app.config['STREAM_BUFFER_SIZE']
+
+    def generate():
+        chunks = []
+        size = 0
+        for chunk in template.generate(context):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                yield ''.join(chunks)
+                chunks = []
+                size = 0
+        if chunks:
+            yield ''.join(chunks)
+
+    return app.response_class(stream_with_context(generate()), mimetype='text/html')
+
 # --------------------- 路由实现 ------------------------ #
 
 @app.route('/')
 @login_required
+@rate_limited('read')
 def index():
     """首页：显示用户信息"""
     user = get_user_by_id(session["user_id"])
@@ -157,9 +473,17 @@ def register():
         if cur.fetchone():
             flash('用户名已存在')
             return render_template('register.html')
-        # 插入新用户
-        db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
-        db.commit()
+        # 插入新用户, 只保存加盐哈希
+        try:
+            password_hash = password_hasher.hash(password)
+        except HasherBusy:
+            flash('系统繁忙，请稍后重试')
+            return render_template('register.html'), 503
+        with write_slot():
+            db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
+            db.commit()
+        # 不推进同步位置, 其他工作进程并发注册的较小id仍由后台同步补齐
+        username_index.add(username)
         flash('注册成功，请登录')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -171,12 +495,32 @@ def login():
         username = request.form['username'].strip()
         password = request.form['password']
         db = get_db()
-        cur = db.execute("SELECT id FROM users WHERE username=? AND password=?", (username, password))
+        cur = db.execute("SELECT id, password FROM users WHERE username=?", (username,))
         user = cur.fetchone()
-        if user:
+        try:
+            # 用户不存在时也做一次同等代价的哈希校验, 避免响应时间暴露用户名是否存在
+            if user is None:
+                ok = password_hasher.verify_missing(password)
+            else:
+                ok = password_hasher.verify(password, user["password"])
+        except HasherBusy:
+            flash('系统繁忙，请稍后重试')
+            return render_template('login.html'), 503
+        if ok:
+            # 旧的明文密码或代价参数已调整时, 借本次登录重新哈希写回
+            new_hash = None
+            if password_hasher.needs_rehash(user["password"]):
+                try:
+                    new_hash = password_hasher.hash(password)
+                except HasherBusy:
+                    pass
+            with write_slot():
+                if new_hash is not None:
+                    db.execute("UPDATE users SET password=? WHERE id=?", (new_hash, user["id"]))
+                    db.commit()
+                # 登录自动生成api token
+                token = update_user_token(user["id"])
             session["user_id"] = user["id"]
-            # 登录自动生成api token
-            token = update_user_token(user["id"])
             session["api_token"] = token
             return redirect(url_for('index'))
         else:
@@ -194,32 +538,41 @@ def logout():
 
 @app.route('/transfer', methods=['GET', 'POST'])
 @login_required
+@rate_limited('write', methods=('POST',))
+@write_admission
 def transfer():
     """转账页面"""
     user = get_user_by_id(session["user_id"])
     if request.method == "POST":
-        to_user_id = request.form['to_user_id']
+        # 收款人可填用户名或用户ID, 用户名优先
+        to_username = request.form.get('to_username', '').strip()
+        to_user_id = request.form.get('to_user_id', '').strip()
         amount = request.form['amount']
         # 校验输入（ID和金额都是数值即可）
         try:
-            to_user_id = int(to_user_id)
+            if not to_username:
+                to_user_id = int(to_user_id)
             amount = float(amount)
         except Exception:
-            flash('请输入正确的用户ID和金额')
+            flash('请输入正确的收款人和金额')
             return render_template('transfer.html', user=user)
         if amount <= 0:
             flash('金额必须大于0')
             return render_template('transfer.html', user=user)
-        if to_user_id == user["id"]:
-            flash('不能给自己转账')
-            return render_template('transfer.html', user=user)
         db = get_db()
         # 目标用户是否存在
-        cur = db.execute("SELECT * FROM users WHERE id=?", (to_user_id,))
+        if to_username:
+            cur = db.execute("SELECT * FROM users WHERE username=?", (to_username,))
+        else:
+            cur = db.execute("SELECT * FROM users WHERE id=?", (to_user_id,))
         to_user = cur.fetchone()
         if not to_user:
             flash('目标用户不存在')
             return render_template('transfer.html', user=user)
+        to_user_id = to_user["id"]
+        if to_user_id == user["id"]:
+            flash('不能给自己转账')
+            return render_template('transfer.html', user=user)
         # 查询自己余额
         if user["balance"] < amount:
             flash("余额不足")
@@ -245,10 +598,15 @@ def transfer():
 
 @app.route('/record')
 @login_required
+@rate_limited('read')
 def record():
     """前端查看转账历史（记录+变动余额）"""
     user_id = session["user_id"]
     user = get_user_by_id(user_id)
+    if app.config['RECORD_STREAMING']:
+        # 流式: 模板边遍历记录边输出, 当前余额由模板在遍历过程中记下
+        records = iter_transfers_with_balance(user_id)
+        return stream_template('record.html', user=user, records=records, last_balance=0.0)
     # 查询全记录（含余额快照）
     records = get_transfers_with_balance(user_id)
     last_balance = get_last_balance_from_records(records)
@@ -256,21 +614,26 @@ def record():
 
 # ------------------- JSON API: 导出全部历史 ------------------- #
 @app.route('/api/records', methods=['GET'])
+@rate_limited('export')
 def api_records():
     """
     用于导出当前用户转账明细（支持token登录），
-    GET参数: token=api_token（可见于前端）
+    GET参数: token=api_token（可见于前端）, format=columnar（可选, 列式二进制, 见columnar.py）
     返回完整的收/支历史流水，每条附带转账之后该用户余额
     """
     token = request.args.get('token')
     if not token:
         return jsonify({"error": "请提供token"}), 403
-    user = get_user_by_token(token)
+    user = get_token_user(token)
     if not user:
         return jsonify({"error": "无效token"}), 403
 
     # 查询该用户全部转账流水及余额快照
     user_id = user["id"]
+    if request.args.get('format') == 'columnar':
+        # 列式二进制: 直接从元组写入类型数组, 用户名去重存为字典
+        data = columnar.encode_transfers(user_id, iter_transfer_tuples(user_id, epoch_time=True))
+        return app.response_class(data, mimetype=columnar.MIMETYPE)
     records = get_transfers_with_balance(user_id)
     for r in records:
         # 保证所有数字都是可序列化
@@ -288,8 +651,99 @@ def api_records():
     }
     return jsonify(result)
 
-# ------------------- 主入口 ------------------- #
-if __name__ == "__main__":
+# ------------------- JSON API: 用户名自动补全 ------------------- #
+@app.route('/api/users/search', methods=['GET'])
+@rate_limited('search')
+def api_users_search():
+    """
+    收款人用户名自动补全, 需登录。
+    GET参数: prefix=用户名前缀, limit=返回条数(可选)
+    只查询内存索引, 不访问数据库
+    """
+    if "user_id" not in session:
+        return jsonify({"error": "请先登录"}), 403
+    prefix = request.args.get('prefix', '')
+    if not prefix:
+        return jsonify({"prefix": prefix, "usernames": []})
+    max_limit = app.config['USER_SEARCH_MAX_LIMIT']
+    limit = request.args.get('limit', max_limit, type=int)
+    limit = max(1, min(limit, max_limit))
+    return jsonify({"prefix": prefix, "usernames": username_index.search(prefix, limit)})
+
+# ------------------- 运行指标 ------------------- #
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    输出当前工作进程的限流状态(令牌桶为进程内计数)、全局写并发闸门状态和用户名索引规模
+    """
+    result = {
+        "pid": os.getpid(),
+        "ratelimit": {},
+        "writes": None,
+        "username_index": username_index.stats(),
+    }
+    for budget, limiter in limiters.items():
+        result["ratelimit"][budget] = limiter.stats()
+    if write_gate is not None:
+        result["writes"] = write_gate.stats()
+    return jsonify(result)
+
+# ------------------- 应用工厂 ------------------- #
+
+def create_app(config=None):
+    """
+    应用工厂: 合并配置并初始化数据库, 返回可交给任意WSGI服务器的app。
+    使用外部prefork服务器(如gunicorn)时, 需在fork之前(preload)调用本函数并将WORKERS设为不少于工作进程数,
+    在其post_fork/worker_exit回调中分别调用run_worker_init_hooks()/run_worker_exit_hooks();
+    写并发闸门按进程pid占用槽位, 不需要稳定的工作进程编号, 已退出进程的槽位会被自动回收
+    """
+    if config:
+        app.config.update(config)
     if not os.path.exists(DATABASE):
         init_db()
-    app.run(debug=False)
+    else:
+        ensure_indexes()
+    init_admission_control()
+    init_password_hasher()
+    username_index.load(DATABASE)
+    return app
+
+# ------------------- 主入口 ------------------- #
+
+def positive_int(value):
+    """argparse类型: 大于等于1的整数"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('必须是大于等于1的整数: %r' % value)
+    return number
+
+def main(argv=None):
+    """命令行入口: 默认启动多进程prefork服务器, --dev 使用Flask开发服务器"""
+    parser = argparse.ArgumentParser(description='AlipayLite 服务入口')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=5000, help='监听端口')
+    parser.add_argument('--workers', type=positive_int, default=None, help='工作进程数, 默认为CPU核心数')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='退出时等待在途请求完成的最长秒数')
+    parser.add_argument('--request-timeout', type=float, default=10.0,
+                        help='单个连接的读写超时秒数')
+    parser.add_argument('--dev', action='store_true', help='使用Flask单进程开发服务器')
+    args = parser.parse_args(argv)
+    if args.dev:
+        create_app()
+        run_worker_init_hooks()
+        try:
+            app.run(host=args.host, port=args.port, debug=False)
+        finally:
+            run_worker_exit_hooks()
+        return
+    from prefork import serve, default_workers
+    workers = args.workers if args.workers is not None else default_workers()
+    create_app({'WORKERS': workers})
+    serve(app, args.host, args.port, workers=workers,
+          post_fork=run_worker_init_hooks, worker_exit=run_worker_exit_hooks,
+          worker_reaped=release_worker_writes,
+          graceful_timeout=args.graceful_timeout, request_timeout=args.request_timeout)
+
+if __name__ == "__main__":
+    main()
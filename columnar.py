@@ -0,0 +1,224 @@
+"""
+columnar.py
+转账流水的紧凑列式二进制导出格式, 以及配套的Python解码器。
+
+JSON导出每一行都重复所有字段名, 大账户的导出体积和序列化时间都很可观。
+列式格式把每个字段存成一段定长类型数组, 用户名统一放进去重后的字典, 行内只存字典下标。
+
+布局 (全部小端):
+    头部   <4sHqdII : 魔数 b'PLC1', 版本号, user_id, current_balance, 行数, 字典条数
+    字典   逐条 <I 长度 + UTF-8 用户名
+    列     按 COLUMNS 顺序依次存放, 每列为 行数 x 该列类型 的原始数组
+时间为UTC秒级时间戳; 用户ID缺失记为-1, 用户名缺失时字典下标记为-1。
+
+命令行对比 (与当前JSON导出的体积/耗时对比):
+    python columnar.py --rows 100000
+"""
+import argparse
+import datetime
+import json
+import struct
+import sys
+import time
+from array import array
+
+MAGIC = b'PLC1'
+VERSION = 1
+MIMETYPE = 'application/x-paylite-columnar'
+
+HEADER = struct.Struct('<4sHqdII')
+NAME_LEN = struct.Struct('<I')
+
+# (列名, array类型码)
+COLUMNS = (
+    ('id', 'q'),
+    ('time', 'q'),
+    ('amount', 'd'),
+    ('post_balance', 'd'),
+    ('from_user', 'q'),
+    ('to_user', 'q'),
+    ('from_name', 'i'),
+    ('to_name', 'i'),
+)
+
+
+def encode_transfers(user_id, rows):
+    """
+    把转账流水编码为列式二进制。
+    rows: 按时间顺序的 (id, time时间戳, amount, from_user, to_user, from_username, to_username, post_balance)
+    元组, post_balance 为该用户在每笔之后的余额, 由调用方计算 (与JSON导出共用同一份计算)。
+    """
+    ids = array('q')
+    times = array('q')
+    amounts = array('d')
+    balances = array('d')
+    from_users = array('q')
+    to_users = array('q')
+    from_names = array('i')
+    to_names = array('i')
+    names = {None: -1}
+    for tid, ts, amount, from_user, to_user, from_username, to_username, post_balance in rows:
+        ids.append(tid)
+        times.append(ts)
+        amounts.append(amount)
+        balances.append(post_balance)
+        from_users.append(-1 if from_user is None else from_user)
+        to_users.append(-1 if to_user is None else to_user)
+        index = names.get(from_username)
+        if index is None:
+            index = names[from_username] = len(names) - 1
+        from_names.append(index)
+        index = names.get(to_username)
+        if index is None:
+            index = names[to_username] = len(names) - 1
+        to_names.append(index)
+
+    del names[None]
+    current_balance = balances[-1] if balances else 0.0
+    parts = [HEADER.pack(MAGIC, VERSION, user_id, current_balance, len(ids), len(names))]
+    for name in names:
+        raw = name.encode('utf-8')
+        parts.append(NAME_LEN.pack(len(raw)))
+        parts.append(raw)
+    for column in (ids, times, amounts, balances, from_users, to_users, from_names, to_names):
+        if sys.byteorder == 'big':
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+
+def decode(data):
+    """
+    解码列式二进制, 返回字典:
+    {"user_id", "current_balance", "usernames": [...], "columns": {列名: array}}
+    """
+    magic, version, user_id, current_balance, count, name_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a PLC1 columnar export')
+    offset = HEADER.size
+    usernames = []
+    for _ in range(name_count):
+        (length,) = NAME_LEN.unpack_from(data, offset)
+        offset += NAME_LEN.size
+        usernames.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    columns = {}
+    for name, typecode in COLUMNS:
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(data[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns[name] = column
+        offset += size
+    return {
+        "user_id": user_id,
+        "current_balance": current_balance,
+        "usernames": usernames,
+        "columns": columns,
+    }
+
+
+def to_records(decoded):
+    """把解码结果还原为与JSON导出相同字段的行字典列表"""
+    columns = decoded["columns"]
+    usernames = decoded["usernames"]
+    records = []
+    for i in range(len(columns["id"])):
+        from_name = columns["from_name"][i]
+        to_name = columns["to_name"][i]
+        from_user = columns["from_user"][i]
+        to_user = columns["to_user"][i]
+        ts = datetime.datetime.fromtimestamp(columns["time"][i], datetime.timezone.utc)
+        records.append({
+            "id": columns["id"][i],
+            "time": ts.strftime('%Y-%m-%d %H:%M:%S'),
+            "amount": columns["amount"][i],
+            "from_user": None if from_user == -1 else from_user,
+            "to_user": None if to_user == -1 else to_user,
+            "from_username": None if from_name == -1 else usernames[from_name],
+            "to_username": None if to_name == -1 else usernames[to_name],
+            "post_balance": columns["post_balance"][i],
+        })
+    return records
+
+
+# ------------------- 体积/耗时对比 ------------------- #
+
+def _sample_rows(count, user_id=1, peers=50):
+    """生成模拟流水 (已带每笔之后的余额, 与应用中 iter_transfer_tuples 的输出一致): 该用户与peers个对象之间交替收付"""
+    base = 1700000000
+    rows = []
+    balance = 0.0
+    for i in range(count):
+        peer = 2 + i % peers
+        if i % 3 == 0:
+            amount = 12.5 + i % 100
+            balance -= amount
+            rows.append((i + 1, base + i * 60, amount, user_id, peer, 'alice', 'user%04d' % peer,
+                         round(balance, 2)))
+        else:
+            amount = 20.0 + i % 50
+            balance += amount
+            rows.append((i + 1, base + i * 60, amount, peer, user_id, 'user%04d' % peer, 'alice',
+                         round(balance, 2)))
+    return rows
+
+
+def _json_export(user_id, rows):
+    """按当前 /api/records 的方式构造逐行字典并序列化为JSON (rows中时间为数据库里的字符串)"""
+    records = []
+    for tid, ts, amount, from_user, to_user, from_username, to_username, post_balance in rows:
+        records.append({
+            "id": tid,
+            "time": ts,
+            "amount": amount,
+            "from_user": from_user,
+            "to_user": to_user,
+            "from_username": from_username,
+            "to_username": to_username,
+            "post_balance": post_balance,
+        })
+    return json.dumps({
+        "username": "alice",
+        "user_id": user_id,
+        "init_balance": 0.0,
+        "current_balance": records[-1]["post_balance"] if records else 0.0,
+        "records": records,
+    }).encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='列式导出与JSON导出的体积/耗时对比')
+    parser.add_argument('--rows', type=int, default=100000, help='模拟流水条数')
+    args = parser.parse_args(argv)
+    rows = _sample_rows(args.rows)
+    # JSON路径直接拿到数据库中的时间字符串, 预先转换以免计入JSON耗时
+    json_rows = []
+    for row in rows:
+        ts = datetime.datetime.fromtimestamp(row[1], datetime.timezone.utc)
+        json_rows.append((row[0], ts.strftime('%Y-%m-%d %H:%M:%S')) + row[2:])
+
+    begin = time.perf_counter()
+    json_data = _json_export(1, json_rows)
+    json_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    columnar_data = encode_transfers(1, rows)
+    columnar_seconds = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    decoded = decode(columnar_data)
+    decode_seconds = time.perf_counter() - begin
+
+    print('rows: %d' % args.rows)
+    print('%-10s %12s %12s' % ('format', 'bytes', 'encode ms'))
+    print('%-10s %12d %12.1f' % ('json', len(json_data), json_seconds * 1000))
+    print('%-10s %12d %12.1f' % ('columnar', len(columnar_data), columnar_seconds * 1000))
+    print('size ratio %.2fx, encode speedup %.2fx, columnar decode %.1f ms (%d usernames)' % (
+        len(json_data) / float(len(columnar_data)), json_seconds / columnar_seconds,
+        decode_seconds * 1000, len(decoded["usernames"])))
+
+
+if __name__ == '__main__':
+    main()
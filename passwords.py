@@ -0,0 +1,269 @@
+"""
+passwords.py
+加盐 scrypt (内存困难型) 密码哈希。
+prefork的单线程工作进程中直接在请求线程计算 (进程数即并发上限); 多线程服务器上可放到有界进程池中执行,
+限制同时计算的哈希数量, 排队已满时快速失败。
+
+存储格式: scrypt$<log2 N>$<r>$<p>$<盐hex>$<哈希hex>
+不带该前缀的旧数据视为明文密码, 由调用方在下次登录成功后重新哈希写回。
+
+命令行基准测试 (不同代价参数下的登录吞吐与延迟):
+    python passwords.py --mode prefork --processes 4 --costs 12 14 15   # 与prefork部署一致
+    python passwords.py --mode threads --concurrency 16 --workers 4      # 多线程服务器 + 进程池
+"""
+import argparse
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+PREFIX = 'scrypt'
+DEFAULT_COST = 14      # N = 2**14, 约16MB内存
+DEFAULT_R = 8
+DEFAULT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """进程池排队已满或等待超时"""
+
+
+def _scrypt(password, salt, cost, r, p):
+    n = 1 << cost
+    # OpenSSL默认内存上限为32MB, 按实际需要放宽
+    maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=maxmem, dklen=KEY_BYTES)
+
+
+def is_hashed(stored):
+    """是否为本模块生成的哈希串 (否则视为旧的明文密码)"""
+    return stored.startswith(PREFIX + '$')
+
+
+def hash_password(password, cost=DEFAULT_COST, r=DEFAULT_R, p=DEFAULT_P):
+    """生成带随机盐的scrypt哈希串"""
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, cost, r, p)
+    return '%s$%d$%d$%d$%s$%s' % (PREFIX, cost, r, p, salt.hex(), key.hex())
+
+
+def verify_password(password, stored):
+    """校验密码, 兼容旧的明文存储; 比较均为常量时间"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, cost, r, p, salt, key = stored.split('$')
+        expected = bytes.fromhex(key)
+        actual = _scrypt(password, bytes.fromhex(salt), int(cost), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def _noop():
+    """预热进程池用的空任务"""
+    return None
+
+
+def _pool_context():
+    """
+    进程池的启动方式: 优先forkserver, 否则spawn。
+    调用方进程里通常已有后台线程 (如用户名索引同步), 直接fork可能复制到被持有的锁而死锁
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class PasswordHasher:
+    """
+    基于有界进程池的密码哈希器。
+    - workers: 进程池大小, 默认CPU核心数; 为0时在当前线程内直接计算 (单线程的prefork工作进程应使用0)
+    - max_pending: 同时排队+计算中的任务上限, 超出后等待timeout秒仍无空位则抛出HasherBusy
+    进程池按pid区分, fork出的子进程会重新创建自己的进程池; start() 会预先拉起全部哈希进程。
+    """
+
+    def __init__(self, cost=DEFAULT_COST, r=DEFAULT_R, p=DEFAULT_P,
+                 workers=None, max_pending=64, timeout=10.0):
+        self.cost = cost
+        self.r = r
+        self.p = p
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._dummy = None
+
+    def _get_pool(self):
+        """返回当前进程的进程池, 不存在则创建; 第二个返回值表示是否为新建"""
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context())
+                self._pool_pid = os.getpid()
+                return self._pool, True
+            return self._pool, False
+
+    def start(self):
+        """创建当前进程的进程池, 拉起全部哈希进程并准备好假哈希, 避免首个登录请求等待"""
+        if self.workers > 0:
+            pool, created = self._get_pool()
+            if created:
+                futures = []
+                for _ in range(self.workers):
+                    futures.append(pool.submit(_noop))
+                for future in futures:
+                    future.result()
+        self._dummy_hash()
+
+    def _dummy_hash(self):
+        """与当前代价参数相同的固定假哈希, 首次使用时在当前进程直接生成 (不占用进程池名额)"""
+        if self._dummy is None:
+            self._dummy = hash_password(secrets.token_hex(16), self.cost, self.r, self.p)
+        return self._dummy
+
+    def shutdown(self):
+        """关闭当前进程创建的进程池"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=True)
+            self._pool = None
+            self._pool_pid = None
+
+    def _release_slot(self, future):
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        future = None
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            pool, created = self._get_pool()
+            future = pool.submit(fn, *args)
+        finally:
+            if future is None:
+                self._slots.release()
+        # 名额在任务真正结束或被取消时才归还: 等待超时后仍在计算的任务继续占着名额
+        future.add_done_callback(self._release_slot)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusy()
+
+    def hash(self, password):
+        """按当前代价参数生成哈希串"""
+        return self._run(hash_password, password, self.cost, self.r, self.p)
+
+    def verify(self, password, stored):
+        """
+        校验密码。旧明文数据本身比较开销很小, 但仍对假哈希做一次同等代价的校验,
+        使响应时间不暴露该用户是否仍为明文存储
+        """
+        if not is_hashed(stored):
+            self._run(verify_password, password, self._dummy_hash())
+            return verify_password(password, stored)
+        return self._run(verify_password, password, stored)
+
+    def verify_missing(self, password):
+        """用户不存在时调用: 对假哈希做一次同等代价的校验后返回False, 使响应时间与用户存在时一致"""
+        self._run(verify_password, password, self._dummy_hash())
+        return False
+
+    def needs_rehash(self, stored):
+        """明文密码或代价参数与当前配置不一致时需要重新哈希"""
+        if not is_hashed(stored):
+            return True
+        parts = stored.split('$')
+        return parts[1:4] != [str(self.cost), str(self.r), str(self.p)]
+
+
+# ------------------- 基准测试 ------------------- #
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100.0))
+    return sorted_values[index]
+
+
+def _timed_login(hasher, stored):
+    begin = time.perf_counter()
+    if not hasher.verify('correct horse battery staple', stored):
+        raise AssertionError('verify failed')
+    return time.perf_counter() - begin
+
+
+def _prefork_logins(cost, count, stored):
+    """模拟一个prefork工作进程: 单线程依次处理count次登录, 哈希在当前线程计算"""
+    hasher = PasswordHasher(cost=cost, workers=0)
+    latencies = []
+    for _ in range(count):
+        latencies.append(_timed_login(hasher, stored))
+    return latencies
+
+
+def benchmark(cost, logins, concurrency, workers, mode='threads', processes=None):
+    """
+    模拟logins次登录校验, 返回吞吐与延迟统计 (延迟为单次校验耗时, 不含客户端排队)。
+    - mode='threads': concurrency个线程共用一个PasswordHasher (workers为进程池大小), 对应多线程服务器
+    - mode='prefork': processes个单线程进程各自直接计算, 对应prefork部署
+    """
+    stored = hash_password('correct horse battery staple', cost)
+    if mode == 'prefork':
+        processes = processes or os.cpu_count() or 1
+        latencies = []
+        begin = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=processes, mp_context=_pool_context()) as pool:
+            futures = []
+            for index in range(processes):
+                count = logins // processes + (1 if index < logins % processes else 0)
+                futures.append(pool.submit(_prefork_logins, cost, count, stored))
+            for future in futures:
+                latencies.extend(future.result())
+        latencies.sort()
+    else:
+        hasher = PasswordHasher(cost=cost, workers=workers, max_pending=concurrency)
+        hasher.start()
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as threads:
+            latencies = sorted(threads.map(lambda _: _timed_login(hasher, stored), range(logins)))
+        hasher.shutdown()
+    elapsed = time.perf_counter() - begin
+    return {
+        "cost": cost,
+        "logins_per_sec": logins / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='登录吞吐/延迟基准测试 (scrypt)')
+    parser.add_argument('--mode', choices=('prefork', 'threads'), default='prefork',
+                        help='prefork: 多个单线程进程直接计算; threads: 多线程共用进程池')
+    parser.add_argument('--costs', type=int, nargs='+', default=[12, 14, 15], help='log2(N) 代价参数列表')
+    parser.add_argument('--logins', type=int, default=200, help='每个代价参数下的登录次数')
+    parser.add_argument('--processes', type=int, default=None, help='prefork模式的进程数, 默认CPU核心数')
+    parser.add_argument('--concurrency', type=int, default=16, help='threads模式的并发登录线程数')
+    parser.add_argument('--workers', type=int, default=None, help='threads模式的进程池大小, 0表示不使用进程池')
+    args = parser.parse_args(argv)
+    print('%-6s %14s %10s %10s %10s' % ('cost', 'logins/sec', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for cost in args.costs:
+        result = benchmark(cost, args.logins, args.concurrency, args.workers, args.mode, args.processes)
+        print('%-6d %14.1f %10.1f %10.1f %10.1f' % (
+            result["cost"], result["logins_per_sec"],
+            result["p50_ms"], result["p95_ms"], result["p99_ms"]))
+
+
+if __name__ == '__main__':
+    main()
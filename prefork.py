@@ -0,0 +1,190 @@
+"""
+prefork.py
+多进程预派生 (prefork) WSGI 服务器, 供生产环境替代 Flask 单进程开发服务器使用。
+
+- 主进程绑定监听端口后 fork 出 N 个工作进程, 所有工作进程共享同一个监听 socket
+- 每个工作进程有固定编号 0..N-1 (补充的进程沿用退出进程的编号), fork 之后先以编号调用
+  post_fork 钩子 (初始化连接池、缓存等), 再开始处理请求, 退出前执行 worker_exit 钩子 (关闭连接池等)
+- 主进程回收退出的工作进程后以其编号调用 worker_reaped 钩子, 用于清理该进程遗留的共享状态
+- 收到 SIGTERM/SIGINT 后主进程通知所有工作进程退出, 工作进程处理完手头请求
+  (例如正在进行的转账事务) 后再退出; 超过 graceful_timeout 仍未退出的进程被强制结束
+- 每个连接有读写超时 (request_timeout), 慢速或半开的连接不会一直占住工作进程
+- 工作进程意外退出时, 主进程自动补充新的工作进程; 若工作进程在初始化钩子中失败,
+  按指数退避重试, 连续失败 max_boot_failures 次后停止服务
+- 依赖 os.fork, 仅支持 Linux / macOS 等 POSIX 系统
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# 工作进程初始化钩子失败时的退出码
+WORKER_BOOT_ERROR = 3
+
+
+class WorkerBootError(Exception):
+    """工作进程初始化钩子 (post_fork) 执行失败"""
+
+
+def default_workers():
+    """默认工作进程数: CPU核心数"""
+    return os.cpu_count() or 1
+
+
+def _worker_loop(app, sock, index, post_fork, worker_exit, poll_interval, request_timeout):
+    """工作进程主循环: 逐个处理请求, 收到退出信号后处理完当前请求再返回"""
+    stopping = []
+
+    def handle_stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    if post_fork is not None:
+        try:
+            post_fork(index)
+        except Exception as exc:
+            raise WorkerBootError() from exc
+    # 单个连接读写超时, 超时后放弃该连接, 继续处理下一个
+    handler = type('RequestHandler', (WSGIRequestHandler,), {'timeout': request_timeout})
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, request_handler=handler, fd=sock.fileno())
+    # 多个进程同时等待同一个socket, 没抢到连接的进程不能阻塞在accept上
+    server.socket.setblocking(False)
+    server.timeout = poll_interval
+    try:
+        while not stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if worker_exit is not None:
+            worker_exit()
+
+
+def _reap(children):
+    """回收已退出的工作进程 (children: pid -> 编号), 返回 (编号, pid, 退出状态) 列表"""
+    reaped = []
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            children.clear()
+            break
+        if pid == 0:
+            break
+        index = children.pop(pid, None)
+        if index is not None:
+            reaped.append((index, pid, status))
+    return reaped
+
+
+def serve(app, host='127.0.0.1', port=8000, workers=None, post_fork=None, worker_exit=None,
+          worker_reaped=None, graceful_timeout=30.0, request_timeout=10.0, max_boot_failures=5,
+          poll_interval=0.5, backlog=128):
+    """
+    启动prefork服务器并阻塞直到收到退出信号。
+    - workers: 工作进程数, 默认CPU核心数
+    - post_fork: 每个工作进程fork后、开始处理请求前调用, 参数为工作进程编号
+    - worker_exit: 每个工作进程处理完在途请求、退出前调用的无参函数
+    - worker_reaped: 主进程回收一个工作进程(无论正常退出还是被强制结束)后调用, 参数为其编号
+    - graceful_timeout: 退出时等待工作进程处理完在途请求的最长秒数
+    - request_timeout: 单个连接的读写超时秒数
+    - max_boot_failures: 工作进程连续初始化失败多少次后放弃, 抛出RuntimeError
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers < 1:
+        raise ValueError('workers must be at least 1, got %r' % workers)
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+
+    children = {}      # pid -> 工作进程编号
+    stopping = []
+
+    def handle_stop(signum, frame):
+        stopping.append(signum)
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _worker_loop(app, sock, index, post_fork, worker_exit, poll_interval, request_timeout)
+            except WorkerBootError:
+                traceback.print_exc()
+                code = WORKER_BOOT_ERROR
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def reaped(index):
+        if worker_reaped is not None:
+            worker_reaped(index)
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    for index in range(workers):
+        spawn(index)
+    print(' * prefork server on http://%s:%d/ (master pid %d, %d workers)'
+          % (host, port, os.getpid(), workers), file=sys.stderr)
+
+    # 主进程只负责看护工作进程: 有进程意外退出就补一个, 初始化失败则退避后再补
+    boot_failures = 0
+    missing = []
+    next_spawn = 0.0
+    while not stopping:
+        time.sleep(poll_interval)
+        for index, pid, status in _reap(children):
+            reaped(index)
+            missing.append(index)
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == WORKER_BOOT_ERROR:
+                boot_failures += 1
+                next_spawn = time.monotonic() + min(poll_interval * 2 ** boot_failures, 30.0)
+                print(' * worker %d failed to boot (%d in a row)' % (pid, boot_failures), file=sys.stderr)
+            else:
+                boot_failures = 0
+                print(' * worker %d exited, respawning' % pid, file=sys.stderr)
+        if boot_failures >= max_boot_failures:
+            print(' * workers keep failing to boot, shutting down', file=sys.stderr)
+            break
+        while missing and not stopping and time.monotonic() >= next_spawn:
+            spawn(missing.pop())
+
+    # 优雅退出: 通知工作进程, 等待在途请求处理完毕
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + graceful_timeout
+    while children and time.monotonic() < deadline:
+        for index, pid, status in _reap(children):
+            reaped(index)
+        if children:
+            time.sleep(0.1)
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    while children:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None:
+            reaped(index)
+    sock.close()
+    if boot_failures >= max_boot_failures:
+        raise RuntimeError('workers failed to boot %d times in a row' % boot_failures)
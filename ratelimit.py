@@ -0,0 +1,186 @@
+"""
+ratelimit.py
+准入控制工具:
+- TokenBucketLimiter: 进程内按key (API token / 登录用户) 维护的令牌桶限流器
+- WriteGate: 全局(跨工作进程)在途写操作并发上限, 超限时直接拒绝而不是排队等待SQLite写锁
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶限流器: 每个key一个桶, 每秒补充rate个令牌, 最多存burst个。
+    桶数量上限为max_keys, 超出时淘汰最久未访问的key, 保证内存有界。
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [剩余令牌, 上次补充时间]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def acquire(self, key, cost=1.0):
+        """尝试取出cost个令牌: 成功返回0, 失败返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self.allowed += 1
+                return 0.0
+            self.rejected += 1
+            return (cost - bucket[0]) / self.rate
+
+    def stats(self):
+        """限流器状态, 用于metrics输出"""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "keys": len(self._buckets),
+                "max_keys": self.max_keys,
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+            }
+
+
+class WriteGate:
+    """
+    全局在途写操作并发上限 (跨工作进程)。
+    共享内存中每个槽位记录 (占用进程pid, 在途写操作数); 每个工作进程在跨进程锁保护下占用一个
+    空闲槽位 (pid为0或所属进程已退出), 之后只修改自己的槽, 不会出现多个进程同时改写同一个计数。
+    工作进程被强制结束后, 其槽位由主进程回收时调用 release_worker() 清零, 或在名额不足时
+    被其他进程检测到占用者已退出而清零, 名额不会泄漏。
+    需在fork之前创建 (外部服务器需以preload方式加载应用), workers 不得少于工作进程数,
+    否则占用槽位时抛出RuntimeError。
+    """
+
+    def __init__(self, limit, workers=1, retry_after=1.0, claim_timeout=5.0):
+        self.limit = limit
+        self.retry_after = retry_after
+        self.claim_timeout = claim_timeout
+        self._owners = multiprocessing.Array('i', workers, lock=False)
+        self._in_flight = multiprocessing.Array('i', workers, lock=False)
+        self._rejected = multiprocessing.Array('l', workers, lock=False)
+        self._claim_lock = multiprocessing.Lock()   # 占用/回收槽位时的跨进程锁
+        self._slot = None
+        self._pid = None
+        self._lock = threading.Lock()   # 同一工作进程内多线程之间互斥
+
+    def _acquire_claim_lock(self):
+        if not self._claim_lock.acquire(timeout=self.claim_timeout):
+            raise RuntimeError('write gate slot lock not released within %.1fs' % self.claim_timeout)
+
+    def _claim(self, index):
+        """为当前进程占用槽位, 优先使用index; 调用方需持有self._lock"""
+        pid = os.getpid()
+        slots = len(self._owners)
+        order = list(range(slots))
+        if index is not None and 0 <= index < slots:
+            order.insert(0, index)
+        self._acquire_claim_lock()
+        try:
+            for slot in order:
+                owner = self._owners[slot]
+                if owner == 0 or owner == pid or not _process_alive(owner):
+                    self._owners[slot] = pid
+                    self._in_flight[slot] = 0
+                    self._slot = slot
+                    self._pid = pid
+                    return slot
+        finally:
+            self._claim_lock.release()
+        raise RuntimeError('all %d write gate slots are held by running processes; '
+                           'WORKERS must be at least the number of worker processes' % slots)
+
+    def _reclaim_dead(self):
+        """清零占用者已退出的槽位, 返回是否有槽位被回收"""
+        reclaimed = False
+        self._acquire_claim_lock()
+        try:
+            for slot in range(len(self._owners)):
+                owner = self._owners[slot]
+                if owner != 0 and not _process_alive(owner):
+                    self._owners[slot] = 0
+                    self._in_flight[slot] = 0
+                    reclaimed = True
+        finally:
+            self._claim_lock.release()
+        return reclaimed
+
+    def bind_worker(self, index=None):
+        """为当前工作进程占用一个槽位, index为可选的首选槽位 (如prefork的工作进程编号)"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._claim(index)
+            return self._slot
+
+    def try_enter(self):
+        """
+        占用一个写入名额, 名额已满返回False。当前进程尚未占用槽位时自动占用。
+        先占位再检查总数: 并发竞争时可能多拒绝, 但不会超过上限
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._claim(None)
+            slot = self._slot
+            self._in_flight[slot] += 1
+            if sum(self._in_flight) > self.limit:
+                if self._reclaim_dead() and sum(self._in_flight) <= self.limit:
+                    return True
+                self._in_flight[slot] -= 1
+                self._rejected[slot] += 1
+                return False
+            return True
+
+    def leave(self):
+        """释放写入名额"""
+        with self._lock:
+            self._in_flight[self._slot] -= 1
+
+    def release_worker(self, index):
+        """清零已退出工作进程的槽位 (由主进程在回收工作进程后调用, 占用者仍存活时不做处理)"""
+        self._acquire_claim_lock()
+        try:
+            owner = self._owners[index]
+            if owner == 0 or not _process_alive(owner):
+                self._owners[index] = 0
+                self._in_flight[index] = 0
+        finally:
+            self._claim_lock.release()
+
+    def stats(self):
+        """并发闸门状态, 用于metrics输出"""
+        return {
+            "limit": self.limit,
+            "in_flight": sum(self._in_flight),
+            "rejected": sum(self._rejected),
+            "slots": len(self._owners),
+            "bound": len(self._owners) - list(self._owners).count(0),
+        }
+
+
+def _process_alive(pid):
+    """pid对应的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
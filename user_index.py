@@ -0,0 +1,201 @@
+"""
+user_index.py
+用户名前缀索引: 内存中按字节序排列的用户名, 二分查找即可回答前缀查询, 不访问SQLite。
+
+- 所有用户名的UTF-8字节拼接成一整块bytes, 另用 array('I') 记录每个名字的起始偏移,
+  每个用户只占 名字字节数 + 4 字节, 没有逐个str对象的开销 (百万用户量级约十几MB)
+- 启动时从数据库按用户名顺序整体加载; 注册时先放入一个小的有序待合并列表,
+  积累到一定数量后由后台线程在锁外合并出新的整块数据再整体替换, 查询不会被合并阻塞
+- 整块数据与待合并列表作为一个元组整体发布, 查询读到的总是同一时刻的一致快照
+- prefork部署下各工作进程各持一份索引, 由后台线程按 id 增量同步其他进程新注册的用户
+- UTF-8字节序与Python字符串顺序、SQLite默认BINARY排序一致
+"""
+import sqlite3
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+# 待合并列表达到 max(MERGE_THRESHOLD, 条目数 // MERGE_RATIO) 条时触发后台合并
+MERGE_THRESHOLD = 1024
+MERGE_RATIO = 256
+
+
+def _pack(encoded_names):
+    """把按字节序排好的UTF-8用户名序列打包为 (blob, offsets), offsets比名字多一项 (末尾为总长度)"""
+    buf = bytearray()
+    offsets = array('I', [0])
+    for raw in encoded_names:
+        buf += raw
+        offsets.append(len(buf))
+    return bytes(buf), offsets
+
+
+def _merge(blob, offsets, new_names):
+    """
+    把有序且不在blob中的新用户名并入 (blob, offsets), 返回新的 (blob, offsets)。
+    旧数据按插入点整段切片拷贝, 偏移整段平移, 不逐个名字执行Python代码
+    """
+    parts = []
+    merged = array('I', [0])
+    prev = 0
+    shift = 0
+    for raw in new_names:
+        i = _lower_bound(blob, offsets, raw)
+        parts.append(blob[offsets[prev]:offsets[i]])
+        merged.extend(map(shift.__add__, offsets[prev + 1:i + 1]))
+        parts.append(raw)
+        shift += len(raw)
+        merged.append(offsets[i] + shift)
+        prev = i
+    parts.append(blob[offsets[prev]:])
+    merged.extend(map(shift.__add__, offsets[prev + 1:]))
+    return b''.join(parts), merged
+
+
+def _lower_bound(blob, offsets, key):
+    """返回第一个不小于key的名字下标"""
+    lo, hi = 0, len(offsets) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if blob[offsets[mid]:offsets[mid + 1]] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class UsernameIndex:
+    """整块有序用户名 + 待合并的新用户名 + 已同步到的最大用户id"""
+
+    def __init__(self):
+        blob, offsets = _pack(())
+        self._state = (blob, offsets, [])   # (blob, offsets, 有序的待合并UTF-8用户名), 整体替换
+        self._generation = 0                # load() 时递增, 使进行中的合并结果作废
+        self._merge_thread = None
+        self._max_id = 0
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def __len__(self):
+        blob, offsets, pending = self._state
+        return len(offsets) - 1 + len(pending)
+
+    def load(self, database):
+        """从数据库整体重建索引"""
+        conn = sqlite3.connect(database)
+        try:
+            rows = conn.execute("SELECT username FROM users ORDER BY username")
+            blob, offsets = _pack(row[0].encode('utf-8') for row in rows)
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+        finally:
+            conn.close()
+        with self._lock:
+            self._state = (blob, offsets, [])
+            self._generation += 1
+            self._max_id = max_id
+
+    def add(self, username, user_id=None):
+        """插入一个用户名 (已存在则忽略)"""
+        raw = username.encode('utf-8')
+        with self._lock:
+            blob, offsets, pending = self._state
+            i = _lower_bound(blob, offsets, raw)
+            exists = i < len(offsets) - 1 and blob[offsets[i]:offsets[i + 1]] == raw
+            j = bisect_left(pending, raw)
+            if not exists and (j == len(pending) or pending[j] != raw):
+                pending = list(pending)
+                insort(pending, raw)
+                self._state = (blob, offsets, pending)
+                threshold = max(MERGE_THRESHOLD, (len(offsets) - 1) // MERGE_RATIO)
+                if len(pending) >= threshold and not self._merging():
+                    self._merge_thread = threading.Thread(target=self.merge, name='username-index-merge',
+                                                          daemon=True)
+                    self._merge_thread.start()
+            if user_id is not None and user_id > self._max_id:
+                self._max_id = user_id
+
+    def _merging(self):
+        thread = self._merge_thread
+        return thread is not None and thread.is_alive()
+
+    def merge(self):
+        """把当前待合并列表并入整块数据: 在锁外构建, 完成后整体替换 (期间新加入的用户名保留在待合并列表)"""
+        with self._lock:
+            blob, offsets, pending = self._state
+            generation = self._generation
+        if not pending:
+            return
+        merged_blob, merged_offsets = _merge(blob, offsets, pending)
+        merged = set(pending)
+        with self._lock:
+            if self._generation != generation:
+                return
+            remaining = []
+            for raw in self._state[2]:
+                if raw not in merged:
+                    remaining.append(raw)
+            self._state = (merged_blob, merged_offsets, remaining)
+
+    def search(self, prefix, limit=10):
+        """返回以prefix开头的前limit个用户名 (按字典序)"""
+        key = prefix.encode('utf-8')
+        blob, offsets, pending = self._state
+        count = len(offsets) - 1
+        found = []
+        i = _lower_bound(blob, offsets, key)
+        while i < count and len(found) < limit:
+            raw = blob[offsets[i]:offsets[i + 1]]
+            if not raw.startswith(key):
+                break
+            found.append(raw)
+            i += 1
+        # 待合并列表里至多再取limit个, 与整块中的结果归并后截断
+        j = bisect_left(pending, key)
+        end = min(len(pending), j + limit)
+        while j < end and pending[j].startswith(key):
+            found.append(pending[j])
+            j += 1
+        found.sort()
+        return [raw.decode('utf-8') for raw in found[:limit]]
+
+    def sync(self, database):
+        """增量同步 id 大于已知最大值的新用户"""
+        conn = sqlite3.connect(database)
+        try:
+            rows = conn.execute("SELECT id, username FROM users WHERE id > ? ORDER BY id",
+                                (self._max_id,)).fetchall()
+        finally:
+            conn.close()
+        for user_id, username in rows:
+            self.add(username, user_id)
+
+    def start_sync(self, database, interval):
+        """启动后台同步线程 (需在fork之后、每个工作进程内调用)"""
+        self._stop = threading.Event()
+        stop = self._stop
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.sync(database)
+                except sqlite3.Error:
+                    pass
+
+        thread = threading.Thread(target=run, name='username-index-sync', daemon=True)
+        thread.start()
+
+    def stop_sync(self):
+        """停止后台同步线程"""
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def stats(self):
+        """索引状态, 用于metrics输出"""
+        blob, offsets, pending = self._state
+        return {
+            "entries": len(self),
+            "bytes": len(blob) + offsets.itemsize * len(offsets),
+            "pending": len(pending),
+            "max_id": self._max_id,
+        }